@@ -1,12 +1,26 @@
+import atexit
 import requests
+from collections import OrderedDict
 from pathlib import Path
-import re
-import shelve
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    from orjson import loads as _parse, dumps as _dumps
+
+except ImportError:
+    from json import loads as _parse, dumps as _json_dumps
+
+    def _dumps(value):
+        return _json_dumps(value).encode('utf-8')
 
 __KEY_FILE = 'key.txt'
-__URL = 'https://api.ipgeolocation.io/ipgeo?'
+__URL = 'https://api.ipgeolocation.io/ipgeo'
+__BULK_URL = 'https://api.ipgeolocation.io/ipgeo-bulk'
 __API_PARAM = 'apiKey'
-_FIELDS = [
+_FIELDS = [sys.intern(field) for field in [
     'domain',
     'ip',
     'hostname',
@@ -34,17 +48,64 @@ _FIELDS = [
     'asn',
     'currency',
     'time_zone'
-]
-_CACHE_FILE = 'cache'
-
-
-class KeyNotFound(BaseException):
+]]
+_FIELDS_SET = frozenset(_FIELDS)
+_ERR_401 = 'It is returned for one of the following reasons:\n' \
+           '\t(1) If API key (as "apiKey" URL parameter) is missing from the request to' \
+           'IP Geolocation API.\n\t(2) If an invalid (a random value) API key is provided.\n\t' \
+           '(3) If the API request is made from an unverified ipgeolocation.io' \
+           ' account.\n\t' \
+           '(4) If your account has been disabled or locked to use by the admin due to' \
+           ' abuse or illegal activity.\n\t(5) When the request to IP Geolocation API is' \
+           'made using API key for a database subscription.\n\t(6) When the request to IP' \
+           ' Geolocation API is made on the "paused" subscription.\n\t(7) If you’re making' \
+           ' API requests after your subscription trial has been expired.\n\t(8) If your ' \
+           'active until date has passed and you need to upgrade your account.\n\t(9) If' \
+           ' bulk IP to geolocation look-ups endpoint is called using free subscription' \
+           ' API key.\n\t(10) If user-agent lookup using custom string or bulk user-agent' \
+           ' look-ups endpoints are called using free subscription API key.\n\t' \
+           '(11) When the wrong input is provided in the request to any endpoint of IP' \
+           ' Geolocation API.'
+_ERR_403 = 'It is returned for one of the following reasons:\n\t(1) If IP to geolocation' \
+           ' look-up for a domain name is done using a free subscription API key.'
+_ERR_404 = 'It is returned for one of the following reasons:\n\t(1) If the queried IP' \
+           ' address or domain name is not found in our database.'
+_ERR_423 = 'If the queried IP address is a [bogon]() (bogus IP address from the bogon' \
+           ' space) IP address.'
+_ERR_429 = 'It is returned for one of the following reasons:\n\t(1) If the API usage ' \
+           'limit has reached for the free subscriptions, or paid subscriptions with' \
+           ' the status "past due", "deleted" or "trial expired".\n\t(2) If the surcharge' \
+           ' API usage limit has reached against the subscribed plan.'
+_ERROR_MESSAGES = {
+    401: _ERR_401,
+    403: _ERR_403,
+    404: _ERR_404,
+    423: _ERR_423,
+    429: _ERR_429
+}
+_CACHE_FILE = 'cache.db'
+_CURRENT_FOLDER = Path(__file__).parent
+_CACHE_PATH = str(_CURRENT_FOLDER.joinpath(_CACHE_FILE))
+_DB = None
+_L1_CACHE = OrderedDict()
+_L1_MAX = 1024
+_NEG_CACHE = OrderedDict()
+_NEG_MAX = 1024
+_NEG_TTL = 300.0
+_KEY_CACHE = None
+_INIT_LOCK = threading.Lock()
+_CACHE_LOCK = threading.RLock()
+_SESSION = requests.Session()
+_SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class KeyNotFound(Exception):
 
     def __init__(self):
         super().__init__('Please register a key before fetching it')
 
 
-class IncorrectIpFormat(BaseException):
+class IncorrectIpFormat(Exception):
 
     def __init__(self, iptype):
         """
@@ -54,7 +115,7 @@ class IncorrectIpFormat(BaseException):
         super().__init__('Incorrect {0} format'.format(iptype))
 
 
-class FieldDoesNotExist(BaseException):
+class FieldDoesNotExist(Exception):
 
     def __init__(self, field):
         """
@@ -64,7 +125,7 @@ class FieldDoesNotExist(BaseException):
         super().__init__('Field {0} is not amongst the possible values'.format(field))
 
 
-class RequestError(BaseException):
+class RequestError(Exception):
     def __init__(self, code, text):
         """
 
@@ -76,6 +137,8 @@ class RequestError(BaseException):
 
 class Response:
 
+    __slots__ = tuple(_FIELDS)
+
     def __init__(self, attributes:dict):
         """
         A class to handle api responses in an object-oriented fashion.
@@ -84,13 +147,13 @@ class Response:
         :param attributes: a dictionary containing the attributes and values to furnish the class.
         """
         for field in _FIELDS:
-            if field in attributes:
-                self.__setattr__(field, attributes[field])
+            setattr(self, field, attributes.get(field, ''))
 
-            else:
-                self.__setattr__(field, '')
-
-        self.currentfolder = Path(__file__).parent
+    def asdict(self):
+        """
+        :return: a dictionary with the api fields and their values.
+        """
+        return {field: getattr(self, field) for field in _FIELDS}
 
     def cache(self):
         """
@@ -98,8 +161,12 @@ class Response:
         :return: nothing
         """
         ip = self.__getattribute__('ip')
-        with shelve.open(str(self.currentfolder.joinpath(_CACHE_FILE)), 'w') as db:
-            db[ip] = self.__dict__
+        attributes = self.asdict()
+        db = _getdb()
+        db.execute('INSERT OR REPLACE INTO ip_cache VALUES(?, ?, ?)',
+                   (ip, _dumps(attributes), time.time()))
+        db.commit()
+        _l1store(ip, attributes)
 
     def uncache(self):
         """
@@ -107,30 +174,74 @@ class Response:
         :return: nothing
         """
         ip = self.__getattribute__('ip')
-        with shelve.open(str(self.currentfolder.joinpath(_CACHE_FILE)), 'w') as db:
-            value = db.get('ip')
-            if value:
-                del db[ip]
+        db = _getdb()
+        db.execute('DELETE FROM ip_cache WHERE ip = ?', (ip,))
+        db.commit()
+        with _CACHE_LOCK:
+            _L1_CACHE.pop(ip, None)
 
     @classmethod
     def retreivefromcache(cls, ip: str):
         """
         Check if the ip has been persisted and build the class instance.
+        The in-memory cache is looked up first; the persistence file only on a miss.
         :param ip:
         :return: class instance or None (if the ip's not been previously persisted
         """
-        currentfolder = Path(__file__).parent
-        with shelve.open(str(currentfolder.joinpath(_CACHE_FILE)), 'c') as db:
-            value = db.get(ip)
-
-        if value:
-            return cls(ip)
+        with _CACHE_LOCK:
+            value = _L1_CACHE.get(ip)
+            if value is not None:
+                _L1_CACHE.move_to_end(ip)
+                return cls(value)
+
+        row = _getdb().execute('SELECT data FROM ip_cache WHERE ip = ?', (ip,)).fetchone()
+        if row:
+            value = _parse(row[0])
+            _l1store(ip, value)
+            return cls(value)
 
         else:
             return None
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.asdict())
+
+
+def _getdb():
+    """
+    Open the persistence database once and reuse it for the rest of the process.
+    WAL mode allows concurrent readers alongside a writer.
+    It is closed automatically at interpreter exit.
+    :return: the sqlite3 connection
+    """
+    global _DB
+    if _DB is not None:
+        return _DB
+
+    with _INIT_LOCK:
+        if _DB is None:
+            db = sqlite3.connect(_CACHE_PATH, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS ip_cache(ip TEXT PRIMARY KEY, data BLOB, ts REAL)')
+            db.commit()
+            atexit.register(db.close)
+            _DB = db
+
+    return _DB
+
+
+def _l1store(ip:str, value:dict):
+    """
+    Insert an entry into the in-memory cache, evicting the least recently used one when full.
+    :param ip: cache key
+    :param value: attributes dictionary of the persisted Response
+    :return: nothing
+    """
+    with _CACHE_LOCK:
+        _L1_CACHE[ip] = value
+        _L1_CACHE.move_to_end(ip)
+        if len(_L1_CACHE) > _L1_MAX:
+            _L1_CACHE.popitem(last=False)
 
 
 def registerkey(keystring:str):
@@ -138,25 +249,35 @@ def registerkey(keystring:str):
     :param keystring: string containing the API KEY.
     :return: nothing. It's just creates a text file to store the key.
     """
-    currentfolder = Path(__file__).parent
-    with open(currentfolder.joinpath(__KEY_FILE),'w') as f:
+    global _KEY_CACHE
+    with open(_CURRENT_FOLDER.joinpath(__KEY_FILE),'w') as f:
         f.write(keystring)
 
+    _KEY_CACHE = keystring
+
 
 def getkey():
     """
-    Get the API KEY
+    Get the API KEY. The key is read from disk once and kept in memory afterwards.
     :return: the key or raises error
     """
-    currentfolder = Path(__file__).parent
-    keyfile = currentfolder.joinpath(__KEY_FILE)
-    if keyfile.exists():
-        with open(keyfile,'r') as f:
-            key = f.read()
+    global _KEY_CACHE
+    if _KEY_CACHE is not None:
+        return _KEY_CACHE
+
+    with _INIT_LOCK:
+        if _KEY_CACHE is not None:
+            return _KEY_CACHE
+
+        try:
+            with open(_CURRENT_FOLDER.joinpath(__KEY_FILE),'r') as f:
+                key = f.read()
+
+        except FileNotFoundError:
+            raise KeyNotFound()
 
+        _KEY_CACHE = key
         return key
-    else:
-        raise KeyNotFound()
 
 
 def listfields():
@@ -169,18 +290,13 @@ def checkipformat(ip:str):
     :param ip: a string to be checked
     :return: None or raises error
     """
-    ipv4 = re.compile('^[0-2]?[0-9]{1,2}\.[0-2]?[0-9]{1,2}\.[0-2]?[0-9]{1,2}\.[0-2]?[0-9]{1,2}$')
-    if ipv4.match(ip):
-        ipv4_chunks = re.compile('\.').split(ip)
-        valid_values = list(filter(lambda v: v < 256,
-                                   map(int,
-                                       ipv4_chunks)
-                                  )
-                           )
-        if len(valid_values) == 4:
-            return None
+    ipv4_chunks = ip.split('.')
+    if len(ipv4_chunks) != 4:
+        raise IncorrectIpFormat('ipv4')
 
-    raise IncorrectIpFormat('ipv4')
+    for chunk in ipv4_chunks:
+        if not (chunk.isascii() and chunk.isdigit()) or len(chunk) > 3 or int(chunk) > 255:
+            raise IncorrectIpFormat('ipv4')
 
 
 def formatfields(fields:[tuple, list]):
@@ -190,10 +306,9 @@ def formatfields(fields:[tuple, list]):
     :return: a string with comma-separated elements
     """
     for field in fields:
-        if field not in _FIELDS:
+        if field not in _FIELDS_SET:
             raise FieldDoesNotExist(field)
 
-    fields = list(map(lambda v: str(v).lower(), fields))
     return ','.join(fields)
 
 
@@ -207,7 +322,7 @@ def get(ip:str=None, fields:[tuple, list]=None, excluded_fields:[tuple, list]=No
     :return: a Response object or raises error
     """
     key = getkey()
-    query_str = __API_PARAM + '=' + key
+    params = {__API_PARAM: key}
     if cache_search and ip:
         value = Response.retreivefromcache(ip)
         if value is not None:
@@ -215,55 +330,78 @@ def get(ip:str=None, fields:[tuple, list]=None, excluded_fields:[tuple, list]=No
 
     if ip:
         checkipformat(ip)
-        query_str += '&ip=' + ip
+        with _CACHE_LOCK:
+            negative = _NEG_CACHE.get(ip)
+            if negative is not None:
+                if time.time() - negative[1] < _NEG_TTL:
+                    raise RequestError(*negative[0])
+
+                del _NEG_CACHE[ip]
+
+        params['ip'] = ip
 
     if fields:
-        include = formatfields(fields)
-        query_str += '&fields=' + include
+        params['fields'] = formatfields(fields)
 
     if excluded_fields:
-        exclude = formatfields(excluded_fields)
-        query_str += '&excludes=' + exclude
+        params['excludes'] = formatfields(excluded_fields)
 
-    r = requests.get(__URL + query_str)
+    r = _SESSION.get(__URL, params=params)
     if r.status_code == 200:
-        return Response(r.json())
-
-    elif r.status_code == 401:
-        raise RequestError(r.status_code, 'It is returned for one of the following reasons:\n'
-                                          '\t(1) If API key (as "apiKey" URL parameter) is missing from the request to'
-                                          'IP Geolocation API.\n\t(2) If an invalid (a random value) API key is provided.\n\t'
-                                          '(3) If the API request is made from an unverified ipgeolocation.io'
-                                          ' account.\n\t'
-                                          '(4) If your account has been disabled or locked to use by the admin due to'
-                                          ' abuse or illegal activity.\n\t(5) When the request to IP Geolocation API is'
-                                          'made using API key for a database subscription.\n\t(6) When the request to IP'
-                                          ' Geolocation API is made on the "paused" subscription.\n\t(7) If you’re making'
-                                          ' API requests after your subscription trial has been expired.\n\t(8) If your '
-                                          'active until date has passed and you need to upgrade your account.\n\t(9) If'
-                                          ' bulk IP to geolocation look-ups endpoint is called using free subscription'
-                                          ' API key.\n\t(10) If user-agent lookup using custom string or bulk user-agent'
-                                          ' look-ups endpoints are called using free subscription API key.\n\t'
-                                          '(11) When the wrong input is provided in the request to any endpoint of IP'
-                                          ' Geolocation API.')
-
-    elif r.status_code == 403:
-        raise RequestError(r.status_code, 'It is returned for one of the following reasons:\n\t(1) If IP to geolocation'
-                                          ' look-up for a domain name is done using a free subscription API key.')
-
-    elif r.status_code == 404:
-        raise RequestError(r.status_code, 'It is returned for one of the following reasons:\n\t(1) If the queried IP'
-                                          ' address or domain name is not found in our database.')
-
-    elif r.status_code == 423:
-        raise RequestError(r.status_code, 'If the queried IP address is a [bogon]() (bogus IP address from the bogon'
-                                          ' space) IP address.')
-
-    elif r.status_code == 429:
-        raise RequestError(r.status_code, 'It is returned for one of the following reasons:\n\t(1) If the API usage '
-                                          'limit has reached for the free subscriptions, or paid subscriptions with'
-                                          ' the status "past due", "deleted" or "trial expired".\n\t(2) If the surcharge'
-                                          ' API usage limit has reached against the subscribed plan.')
-    else:
+        return Response(_parse(r.content))
+
+    message = _ERROR_MESSAGES.get(r.status_code)
+    if message is None:
         raise RequestError('Unknown', 'Unknown')
 
+    if ip:
+        with _CACHE_LOCK:
+            _NEG_CACHE[ip] = ((r.status_code, message), time.time())
+            if len(_NEG_CACHE) > _NEG_MAX:
+                _NEG_CACHE.popitem(last=False)
+
+    raise RequestError(r.status_code, message)
+
+
+def get_bulk(ips:[tuple, list], fields:[tuple, list]=None, excluded_fields:[tuple, list]=None, cache_search=True):
+    """
+    Executes a single api request for several ips through the bulk endpoint.
+    :param ips: a list or tuple of ips to be queried.
+    :param fields: fields to be included in the api response. If None, it returns all available fields.
+    :param excluded_fields: fields to be be excluded in the api response.
+    :param cache_search: if true, cached ips are served from the cache and left out of the request.
+    :return: a list of Response objects, in the same order as ips, or raises error
+    """
+    key = getkey()
+    found = {}
+    missing = []
+    for ip in ips:
+        checkipformat(ip)
+        value = Response.retreivefromcache(ip) if cache_search else None
+        if value is not None:
+            found[ip] = value
+
+        else:
+            missing.append(ip)
+
+    if missing:
+        params = {__API_PARAM: key}
+        if fields:
+            params['fields'] = formatfields(fields)
+
+        if excluded_fields:
+            params['excludes'] = formatfields(excluded_fields)
+
+        r = _SESSION.post(__BULK_URL, json={'ips': missing}, params=params)
+        if r.status_code != 200:
+            message = _ERROR_MESSAGES.get(r.status_code)
+            if message is None:
+                raise RequestError('Unknown', 'Unknown')
+
+            raise RequestError(r.status_code, message)
+
+        for attributes in _parse(r.content):
+            found[attributes['ip']] = Response(attributes)
+
+    return [found[ip] for ip in ips]
+
@@ -0,0 +1,84 @@
+import aiohttp
+import time
+
+from .geoapy import Response, RequestError, checkipformat, formatfields, getkey, \
+    _CACHE_LOCK, _ERROR_MESSAGES, _NEG_CACHE, _NEG_MAX, _NEG_TTL, _parse
+
+__URL = 'https://api.ipgeolocation.io/ipgeo'
+__API_PARAM = 'apiKey'
+_AIO_SESSION = None
+
+
+async def _getsession():
+    """
+    Build the shared aiohttp session on first use and reuse it afterwards,
+    so concurrent lookups share one connection pool.
+    :return: the aiohttp client session
+    """
+    global _AIO_SESSION
+    if _AIO_SESSION is None or _AIO_SESSION.closed:
+        _AIO_SESSION = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=32))
+
+    return _AIO_SESSION
+
+
+async def close():
+    """
+    Close the shared aiohttp session.
+    :return: nothing
+    """
+    if _AIO_SESSION is not None and not _AIO_SESSION.closed:
+        await _AIO_SESSION.close()
+
+
+async def get_async(ip:str=None, fields:[tuple, list]=None, excluded_fields:[tuple, list]=None, cache_search=True):
+    """
+    Asynchronous counterpart of geoapy.get. Several independent lookups can be
+    awaited concurrently, e.g. asyncio.gather(*[get_async(ip) for ip in ips]).
+    :param ip: if None, it queries the requestor's ip.
+    :param fields: fields to be included in the api response. If None, it returns all available fields.
+    :param excluded_fields: fields to be be excluded in the api response.
+    :param cache_search: if true, it first check if the searched ip has been previously sought and persisted.
+    :return: a Response object or raises error
+    """
+    key = getkey()
+    params = {__API_PARAM: key}
+    if cache_search and ip:
+        value = Response.retreivefromcache(ip)
+        if value is not None:
+            return value
+
+    if ip:
+        checkipformat(ip)
+        with _CACHE_LOCK:
+            negative = _NEG_CACHE.get(ip)
+            if negative is not None:
+                if time.time() - negative[1] < _NEG_TTL:
+                    raise RequestError(*negative[0])
+
+                del _NEG_CACHE[ip]
+
+        params['ip'] = ip
+
+    if fields:
+        params['fields'] = formatfields(fields)
+
+    if excluded_fields:
+        params['excludes'] = formatfields(excluded_fields)
+
+    session = await _getsession()
+    async with session.get(__URL, params=params) as r:
+        if r.status == 200:
+            return Response(_parse(await r.read()))
+
+        message = _ERROR_MESSAGES.get(r.status)
+        if message is None:
+            raise RequestError('Unknown', 'Unknown')
+
+        if ip:
+            with _CACHE_LOCK:
+                _NEG_CACHE[ip] = ((r.status, message), time.time())
+                if len(_NEG_CACHE) > _NEG_MAX:
+                    _NEG_CACHE.popitem(last=False)
+
+        raise RequestError(r.status, message)